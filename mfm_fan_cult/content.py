@@ -19,9 +19,11 @@ import os
 from datetime import datetime
 
 import click
-from bs4 import BeautifulSoup
+from lxml import html as lxml_html
 from feedgen.feed import FeedGenerator
 from requests import Session, RequestException
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from sqlalchemy_utils import EmailType
 from sqlalchemy.dialects.sqlite import BLOB
@@ -29,6 +31,11 @@ from sqlalchemy import Table, Column, String, DateTime, func
 from sqlalchemy.exc import MultipleResultsFound, NoResultFound
 
 
+def has_class(name):
+    """Build an XPath predicate matching elements with a CSS class."""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
 class FanCultContent:
     """Base content class that also provides account access."""
     command = 'account'
@@ -51,6 +58,13 @@ class FanCultContent:
         'Referer': base_url,
         'Origin': base_url
     }
+    # Connection pool and retry settings for HTTP requests
+    pool_connections = 4
+    pool_maxsize = 32
+    max_retries = 3
+    retry_backoff = 0.2
+    # Number of HTTP requests to make concurrently
+    max_workers = 8
     # Set CLI details for account management
     command_help = 'Manage your Fan Cult account.'
     commands = ['login', 'update', 'show']
@@ -58,10 +72,24 @@ class FanCultContent:
     def __init__(self, manager):
         """Setup details for content class."""
         self.manager = manager
-        self.session = Session()
+        self.session = self._get_http_session()
         self.db = self.manager.get_session()
         self.model = self.manager.models.get(self.model_name)
 
+    def _get_http_session(self):
+        """Create a HTTP session with pooled keep-alive connections."""
+        session = Session()
+        session.headers.update(self.headers)
+        # Reuse connections across requests to the same host
+        retries = Retry(total=self.max_retries,
+                        backoff_factor=self.retry_backoff)
+        adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                              pool_maxsize=self.pool_maxsize,
+                              max_retries=retries)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
     def auto_login_user(self, with_account=False):
         """Decorator to automatically log user in for CLI actions."""
         def inner(fn):
@@ -93,9 +121,8 @@ class FanCultContent:
             # Prompt user to select an account
             user_idx = click.prompt(
                 '\nEnter account number',
-                type=click.Choice(range(len(all_accounts))),
-                show_choices=False,
-                default='0'
+                type=click.IntRange(0, len(all_accounts) - 1),
+                default=0
             )
             # Use the selected account
             account = all_accounts[user_idx]
@@ -124,8 +151,8 @@ class FanCultContent:
         res = self.session.get(self.login_url)
 
         # Parse login form
-        soup = BeautifulSoup(res.text, 'html.parser')
-        login_form = soup.find('form')
+        doc = lxml_html.fromstring(res.content)
+        login_form = doc.find('.//form')
         login_url = self.base_url + login_form.get('action')
 
         # Make login request
@@ -133,7 +160,7 @@ class FanCultContent:
             'Username': username,
             'Password': password,
             'RememberMe': 'true'
-        }, headers=self.headers)
+        })
 
         # Check login request result
         try:
@@ -150,6 +177,13 @@ class FanCultContent:
         # Return success
         return True
 
+    @staticmethod
+    def _get_search_pattern(search):
+        """Build a LIKE pattern matching the search text literally."""
+        for char in ('\\', '%', '_'):
+            search = search.replace(char, f'\\{char}')
+        return f'%{search}%'
+
     def _get_rss_feed_generator(self, podcast=False):
         """Create a RSS feed generator object."""
         fg = FeedGenerator()
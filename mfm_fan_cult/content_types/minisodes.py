@@ -18,23 +18,49 @@ along with this program.  If not, see [https://www.gnu.org/licenses/].
 import os
 import re
 import time
-from math import ceil
+from datetime import timezone
+from concurrent.futures import ThreadPoolExecutor
 from textwrap import shorten, TextWrapper
 
-import pytz
 import click
 from tqdm import tqdm
 from dateutil import parser
 from mutagen.mp3 import MP3
-from bs4 import BeautifulSoup
+from lxml import etree, html as lxml_html
 from urllib.request import urlretrieve
 from tabulate import tabulate, tabulate_formats
 
 from sqlalchemy.sql import or_
-from sqlalchemy import Table, Column, DateTime, Integer, String, func
+from sqlalchemy.orm import load_only
+from sqlalchemy import Table, Column, DateTime, Index, Integer, String, func
+from sqlalchemy import lambda_stmt, select
 from sqlalchemy_utils.types import URLType
 
-from mfm_fan_cult.content import FanCultContent
+from mfm_fan_cult.content import FanCultContent, has_class
+
+
+# Compiled XPath expressions for parsing the episode list
+_XP_FAN_CULT_EPS = etree.XPath(
+    f"(//div[{has_class('eps')}])[1]//div[{has_class('fancult-tag')}]"
+)
+
+# Compiled XPath expressions for parsing episodes, returning plain strings
+# rather than smart strings that keep a reference to the tree
+_DATE = f"(.//div[{has_class('ep-date')}])[1]"
+_XP_TITLE = etree.XPath('string((.//h1)[1])', smart_strings=False)
+_XP_HREF = etree.XPath('string((.//a)[1]/@href)', smart_strings=False)
+_XP_DAY = etree.XPath(f'string({_DATE}//h3)', smart_strings=False)
+_XP_MONTH_YEAR = etree.XPath(f'string({_DATE}//h4)', smart_strings=False)
+
+# Compiled XPath expressions for parsing episode pages
+_ABOUT = f"(//div[{has_class('home-about')}])[1]"
+_XP_DESC = etree.XPath(f'string({_ABOUT}//p)', smart_strings=False)
+_XP_IMG = etree.XPath(f'string({_ABOUT}//img/@src)', smart_strings=False)
+_XP_SCRIPT = etree.XPath("string((//script[not(@src) or @src=''])[2])",
+                         smart_strings=False)
+
+# Compiled pattern for the audio file URL in the episode page script
+_M4A_RE = re.compile(r'm4a:\s*"([^"]+)"')
 
 
 class MinisodeContent(FanCultContent):
@@ -43,8 +69,9 @@ class MinisodeContent(FanCultContent):
     model_name = command
     # Minisode-specific URL for HTTP requests
     episodes_url = f'{FanCultContent.base_url}/episodes'
-    # Download chunk size
-    chunk_size = 1024
+    # Download chunk and file buffer sizes
+    chunk_size = 262144
+    buffer_size = 1048576
     # Set CLI details for minisodes
     command_help = 'Manage Fan Cult exclusive minisodes.'
     commands = ['list', 'update', 'show', 'download', 'open', 'feed']
@@ -52,54 +79,65 @@ class MinisodeContent(FanCultContent):
     def _update_episodes(self):
         """Add new episodes to database."""
         res = self.session.get(self.episodes_url)
-        soup = BeautifulSoup(res.text, 'html.parser')
+        doc = lxml_html.fromstring(res.content)
 
         # Get only fan cult episodes
-        all_eps = soup.find('div', class_='eps')
-        fan_cult_eps = all_eps.find_all('div', class_='fancult-tag')
-
-        #  Set up progress bar data
-        progress_bar = {
-            'iterable': fan_cult_eps,
-            'unit': 'minisodes',
-            'desc': 'Scanning for new minisodes',
-            'bar_format': '{l_bar}{bar}| {n_fmt}/{total_fmt} {unit}'
-        }
-
-        # Parse list of episodes
+        fan_cult_eps = _XP_FAN_CULT_EPS(doc)
+
+        # Skip episodes that are already stored or listed twice
+        existing = self._get_episode_keys()
+        new_eps = []
+        for fan_cult_ep in fan_cult_eps:
+            ep = fan_cult_ep.getparent().getparent()
+            ep_key = self._get_episode_key(ep)
+            if ep_key not in existing:
+                existing.add(ep_key)
+                new_eps.append(ep)
+
+        # Fetch new episode pages concurrently
         added = []
-        for fan_cult_ep in tqdm(**progress_bar):
-            episode = self._create_episode(fan_cult_ep.parent.parent)
-            if episode:
-                added.append(episode)
-                self.db.add(episode)
-
-        # Commit the session, if needed
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            #  Set up progress bar data
+            progress_bar = {
+                'iterable': executor.map(self._create_episode, new_eps),
+                'total': len(new_eps),
+                'unit': 'minisodes',
+                'desc': 'Scanning for new minisodes',
+                'bar_format': '{l_bar}{bar}| {n_fmt}/{total_fmt} {unit}'
+            }
+
+            # Parse list of episodes
+            for episode in tqdm(**progress_bar):
+                if episode:
+                    added.append(episode)
+
+        # Add and commit all new episodes at once, if needed
         if added:
+            self.db.add_all(added)
             self.db.commit()
 
         # Return the list of added episodes
         return added
 
+    def _get_episode_key(self, ep):
+        """Parse the episode title and URL from the episode list."""
+        ep_title = _XP_TITLE(ep).strip()
+        ep_url = self.base_url + _XP_HREF(ep).strip()
+        return ep_title, ep_url
+
     def _create_episode(self, ep):
         """Creates a new episode database entry."""
-        ep_url = self.base_url + ep.a['href'].strip()
-        ep_title = ep.h1.text.strip()
-
-        # Check for existing
-        if self._find_episode(ep_title, ep_url):
-            return None
+        ep_title, ep_url = self._get_episode_key(ep)
 
         # Get episode page content
         res = self.session.get(ep_url)
-        soup = BeautifulSoup(res.text, 'html.parser')
-
-        # Parse episode page
-        about = soup.find('div', class_='home-about')
-        script = soup.find_all('script', src='')[1]
+        doc = lxml_html.fromstring(res.content)
 
         # Get audio file URL
-        audio_url = re.search(r'm4a: "(.+)"', str(script)).group(1).strip()
+        audio_match = _M4A_RE.search(_XP_SCRIPT(doc))
+        if not audio_match:
+            return None
+        audio_url = audio_match.group(1)
         if not audio_url.startswith('http'):
             return None
 
@@ -107,19 +145,27 @@ class MinisodeContent(FanCultContent):
         filename, headers = urlretrieve(audio_url)
         audio = MP3(filename)
 
+        # Only the metadata is stored, so drop the temporary audio file
+        os.remove(filename)
+
         # Return the new episode object
         return self.model(
             title=ep_title,
-            description=about.p.text.strip(),
+            description=_XP_DESC(doc).strip(),
             date=self._get_episode_date(ep),
             url=ep_url,
-            image=about.img['src'].strip(),
+            image=_XP_IMG(doc).strip(),
             audio=audio_url,
             duration=audio.info.length,
             size=int(headers.get('Content-Length')),
             filetype=headers.get('Content-Type'),
         )
 
+    def _get_episode_keys(self):
+        """Get the title and URL of every episode in the database."""
+        query = self.db.query(self.model.title, self.model.url)
+        return {(title, str(url)) for title, url in query}
+
     def _find_episode(self, title, url):
         """Search for episode in the database by title and URL."""
         return self.db.query(self.model)\
@@ -139,18 +185,19 @@ class MinisodeContent(FanCultContent):
 
         # Set up progress bar data
         progress_bar = {
-            'iterable': stream.iter_content(chunk_size=self.chunk_size),
-            'total': int(ceil(total_length / float(self.chunk_size))),
-            'unit': 'KB',
+            'total': total_length,
+            'unit': 'B',
+            'unit_scale': True,
             'desc': file_name
         }
 
         # Download the file and display progress
-        with open(file_path, "wb") as f:
-            for chunk in tqdm(**progress_bar):
+        with open(file_path, "wb", buffering=self.buffer_size) as f, \
+                tqdm(**progress_bar) as progress:
+            for chunk in stream.iter_content(chunk_size=self.chunk_size):
                 if chunk:
                     f.write(chunk)
-                    f.flush()
+                    progress.update(len(chunk))
 
         # Check that the file was downloaded
         if not os.path.isfile(file_path):
@@ -159,9 +206,8 @@ class MinisodeContent(FanCultContent):
     @staticmethod
     def _get_episode_date(ep):
         """Parse the episode date into a datetime object."""
-        date_div = ep.find('div', class_='ep-date')
-        date_dd = date_div.h3.text.strip()
-        date_mm_yy = date_div.h4.text.strip()
+        date_dd = _XP_DAY(ep)
+        date_mm_yy = _XP_MONTH_YEAR(ep)
         return parser.parse(f'{date_dd} {date_mm_yy}')
 
     def _create_episode_feed(self, file_dir, print_=False):
@@ -173,6 +219,12 @@ class MinisodeContent(FanCultContent):
 
         # Get all minisodes
         episodes = self.db.query(self.model) \
+            .options(load_only(
+                self.model.minisode_id, self.model.title,
+                self.model.description, self.model.date, self.model.url,
+                self.model.image, self.model.audio, self.model.duration,
+                self.model.size, self.model.filetype
+            )) \
             .order_by(self.model.date.asc()) \
             .all()
 
@@ -186,7 +238,7 @@ class MinisodeContent(FanCultContent):
             fe.id(str(episode.minisode_id))
             fe.title(episode.title)
             fe.description(episode.description)
-            fe.published(pytz.utc.localize(episode.date))
+            fe.published(episode.date.replace(tzinfo=timezone.utc))
             fe.link(href=episode.url)
             fe.podcast.itunes_author('Exactly Right')
             fe.podcast.itunes_image(episode.image)
@@ -221,6 +273,7 @@ class MinisodeContent(FanCultContent):
             Column('filetype', String, nullable=False),
             Column('last_updated', DateTime, server_default=func.now(),
                    onupdate=func.now(), nullable=False),
+            Index('ix_minisodes_title_url', 'title', 'url'),
         )
 
     @staticmethod
@@ -239,7 +292,7 @@ class MinisodeContent(FanCultContent):
 
     def get_episode(self, episode_id):
         """Get minisode in database by ID."""
-        episode = self.db.query(self.model).get(episode_id)
+        episode = self.db.get(self.model, episode_id)
         if not episode:
             self.manager.error(f'No minisode found for ID: {episode_id}')
             return None
@@ -342,20 +395,24 @@ class MinisodeContent(FanCultContent):
             """Show all available minisodes."""
             if refresh:
                 self._update_episodes()
-            # Set up query
-            query = self.db.query(self.model)\
-                .order_by(self.model.date.desc())
+            # Set up cacheable query
+            model = self.model
+            stmt = lambda_stmt(lambda: select(model).options(load_only(
+                model.minisode_id, model.date, model.title,
+                model.description, model.duration, model.url
+            )).order_by(model.date.desc()))
             # Handle search query
             if search:
-                query = query.filter(or_(
-                    self.model.title.like(f'%{search}%'),
-                    self.model.description.like(f'%{search}%')
+                pattern = self._get_search_pattern(search)
+                stmt += lambda s: s.where(or_(
+                    model.title.like(pattern, escape='\\'),
+                    model.description.like(pattern, escape='\\')
                 ))
             # Handle limit
             if number > 0:
-                query = query.limit(number)
+                stmt += lambda s: s.limit(number)
             # Run the query
-            episodes = query.all()
+            episodes = self.db.execute(stmt).scalars().all()
             if not episodes:
                 self.manager.warning('No minisodes found.')
                 return
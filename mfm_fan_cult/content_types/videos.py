@@ -16,20 +16,50 @@ along with this program.  If not, see [https://www.gnu.org/licenses/].
 """
 
 import os
-from textwrap import shorten
+import re
+from datetime import datetime, timezone
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from textwrap import TextWrapper
 
-import pytz
 import click
+import orjson
 from tqdm import tqdm
 from dateutil import parser
-from bs4 import BeautifulSoup
-from vimeo_downloader import Vimeo
+from lxml import etree, html as lxml_html
 from tabulate import tabulate, tabulate_formats
 
 from sqlalchemy_utils.types import URLType
-from sqlalchemy import Table, Column, DateTime, Integer, String, func
+from sqlalchemy import Table, Column, DateTime, Index, Integer, String, func
 
-from mfm_fan_cult.content import FanCultContent
+from mfm_fan_cult.content import FanCultContent, has_class
+
+
+# Compiled XPath expressions for parsing the news feed
+_XP_ARTICLES = etree.XPath(
+    f"(//div[{has_class('news-grid')}])[1]//div[not(@class) or @class='']"
+)
+
+# Compiled XPath expressions for parsing articles, returning plain strings
+# rather than smart strings that keep a reference to the tree
+_XP_TITLE = etree.XPath('string((.//h1)[1])', smart_strings=False)
+_XP_HREF = etree.XPath('string((.//a)[1]/@href)', smart_strings=False)
+_XP_INFO = etree.XPath('string((.//h6)[1])', smart_strings=False)
+_XP_VIMEO = etree.XPath(
+    f"string((.//div[{has_class('bg-image')}])[1]/@data-vimeo)",
+    smart_strings=False
+)
+
+# Compiled pattern for the player URL in the oEmbed iframe HTML
+_SRC_RE = re.compile(r'src="([^"]+)"')
+
+# Shared wrapper for shortening long list columns
+_SHORTENER = TextWrapper(width=50, max_lines=1, placeholder=' [...]')
+
+
+def _shorten(text):
+    """Collapse and truncate text to fit in a list column."""
+    return _SHORTENER.fill(' '.join(text.strip().split()))
 
 
 class VideoContent(FanCultContent):
@@ -42,6 +72,12 @@ class VideoContent(FanCultContent):
     # Thumbnail generator URL
     vimeo_thumbnail = 'https://i.vimeocdn.com/filter/overlay?src0={src}' \
                       'src1=http%3A%2F%2Ff.vimeocdn.com%2Fp%2Fimages%2Fcrawler_play.png'
+    # Date format used by news articles
+    date_format = '%B %d, %Y'
+    # Feed entry content template
+    feed_content = '<p>%s</p><p><a href="%s"><img src="%s"/></a></p>'
+    # Download chunk size
+    chunk_size = 262144
     # Set CLI details for videos
     command_help = 'Manage Fan Cult exclusive videos.'
     commands = ['list', 'update', 'show', 'download', 'open', 'feed']
@@ -56,70 +92,96 @@ class VideoContent(FanCultContent):
         })
 
         # Parse news feed results
-        soup = BeautifulSoup(res.text, 'html.parser')
-        news = soup.find('div', class_='news-grid')
-        all_articles = news.find_all('div', class_='')
-
-        #  Set up progress bar data
-        progress_bar = {
-            'iterable': all_articles,
-            'unit': 'videos',
-            'desc': 'Scanning for new videos',
-            'bar_format': '{l_bar}{bar}| {n_fmt}/{total_fmt} {unit}'
-        }
+        doc = lxml_html.fromstring(res.content)
+        all_articles = _XP_ARTICLES(doc)
+
+        # Parse articles, skipping any that are already stored
+        existing = self._get_video_keys()
+        new_videos = []
+        for article in all_articles:
+            video = self._parse_article(article, existing)
+            if video:
+                new_videos.append(video)
 
-        # Parse articles
+        # Fetch new video metadata concurrently
         added = []
-        for article in tqdm(**progress_bar):
-            video = self._create_video(article)
-            if video:
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            #  Set up progress bar data
+            progress_bar = {
+                'iterable': executor.map(self._create_video, new_videos),
+                'total': len(new_videos),
+                'mininterval': 0.5,
+                'miniters': max(1, len(new_videos) // 100),
+                'unit': 'videos',
+                'desc': 'Scanning for new videos',
+                'bar_format': '{l_bar}{bar}| {n_fmt}/{total_fmt} {unit}'
+            }
+
+            # Create video entries
+            for video in tqdm(**progress_bar):
                 added.append(video)
-                self.db.add(video)
 
-        # Only commit the changes if anything was added
+        # Only add and commit the changes if anything was added
         if added:
+            self.db.add_all(added)
             self.db.commit()
 
         # Return the list of added videos
         return added
 
+    def _get_video_keys(self):
+        """Get the title and URL of every video in the database."""
+        query = self.db.query(self.model.title, self.model.url)
+        return {(title, str(url)) for title, url in query}
+
     def _find_video(self, title, url):
         """Searches for a video in the database by title and URL."""
         return self.db.query(self.model)\
             .filter_by(title=title, url=url)\
             .one_or_none()
 
-    def _create_video(self, article):
-        """Creates a new video entry in the database."""
-        if not article.h1:
+    def _parse_article(self, article, existing):
+        """Parses new video details from a news article."""
+        if article.find('.//h1') is None:
             return None
 
         # Parse the title and URL from the HTML
-        video_title = article.h1.text.strip()
-        video_url = self.base_url + article.a['href'].strip()
+        video_title = _XP_TITLE(article).strip()
+        video_url = self.base_url + _XP_HREF(article).strip()
 
-        # Exit if the video already exists
-        if self._find_video(video_title, video_url):
+        # Exit if the video already exists or was already seen
+        if (video_title, video_url) in existing:
             return None
+        existing.add((video_title, video_url))
 
         # Parse the date and video type
-        date_str, video_type = article.h6.text.strip()[:-1].split(' - ')
+        date_str, video_type = _XP_INFO(article).strip()[:-1].split(' - ')
+
+        # Return the video details
+        return {
+            'title': video_title,
+            'type': video_type,
+            'date': self._parse_date(date_str),
+            'url': video_url,
+            'video': _XP_VIMEO(article)
+        }
 
-        # Parse the vimeo URL
-        vimeo_url = article.find('div', class_='bg-image')['data-vimeo']
+    def _parse_date(self, date_str):
+        """Parse an article date, falling back to fuzzy parsing."""
+        try:
+            return datetime.strptime(date_str, self.date_format)
+        except ValueError:
+            return parser.parse(date_str)
 
-        # Get file metadata
-        video_metadata = self._get_video_metadata(vimeo_url)
+    def _create_video(self, video):
+        """Creates a new video entry in the database."""
+        video_metadata = self._get_video_metadata(video['video'])
 
         # Return the new video object
         return self.model(
-            title=video_title,
-            type=video_type,
-            date=parser.parse(date_str),
-            url=video_url,
             image=video_metadata['thumbnail_url'],
             video_image=video_metadata['thumbnail_url_with_play_button'],
-            video=vimeo_url
+            **video
         )
 
     def _get_video_metadata(self, video_url):
@@ -127,16 +189,18 @@ class VideoContent(FanCultContent):
         vimeo_video_url = self.vimeo_url + video_url
 
         # Get video JSON metadata from Vimeo
-        res = self.session.get(vimeo_video_url, headers=self.headers)
-        return res.json()
+        res = self.session.get(vimeo_video_url)
+        return orjson.loads(res.content)
 
-    def _download_video(self, video, video_path, yes):
+    def _download_video(self, video, video_path, yes, parallel=1):
         """Downloads a video file to the specified path."""
+        from vimeo_downloader import Vimeo
+
         video_metadata = self._get_video_metadata(video.video)
 
         # Parse iframe for src URL
-        soup = BeautifulSoup(video_metadata['html'], 'html.parser')
-        video_src = soup.iframe['src'].strip().split('?')[0]
+        iframe_src = _SRC_RE.search(video_metadata['html']).group(1)
+        video_src = iframe_src.strip().split('?')[0]
 
         # Creat a new Vimeo video object
         vimeo = Vimeo(video_src, embedded_on=video.url)
@@ -154,13 +218,82 @@ class VideoContent(FanCultContent):
         if not file_path:
             return
 
-        # Perform the download
-        stream.download(download_directory=video_path)
+        # Perform the download, over several connections if requested
+        ranged = parallel > 1 and \
+            self._download_ranges(stream.direct_url, file_path, parallel)
+        if not ranged:
+            stream.download(download_directory=video_path)
 
         # Check that the file was downloaded
         if not os.path.isfile(file_path):
             self.manager.error(f'Problem downloading file: {file_path}')
 
+    def _download_ranges(self, url, file_path, connections):
+        """Downloads a file as byte ranges over multiple connections."""
+        res = self.session.head(url, allow_redirects=True)
+        total_length = int(res.headers.get('content-length', 0))
+
+        # Fall back to a single stream if ranges are not supported
+        if res.headers.get('accept-ranges') != 'bytes' or not total_length:
+            return False
+
+        # Split the file into one byte range per connection
+        part_size = -(-total_length // connections)
+        ranges = [
+            (start, min(start + part_size, total_length) - 1)
+            for start in range(0, total_length, part_size)
+        ]
+
+        # Size the file up front so each range can be written in place
+        with open(file_path, 'wb') as f:
+            f.truncate(total_length)
+
+        # Set up progress bar data
+        progress_bar = {
+            'total': total_length,
+            'unit': 'B',
+            'unit_scale': True,
+            'desc': os.path.basename(file_path)
+        }
+
+        # Download the ranges concurrently and display progress
+        try:
+            with tqdm(**progress_bar) as progress:
+                download = partial(self._download_range, url, file_path,
+                                   progress=progress)
+                with ThreadPoolExecutor(max_workers=connections) as executor:
+                    ranged = all(list(executor.map(download, ranges)))
+        except BaseException:
+            # Do not leave a partially written file behind
+            os.remove(file_path)
+            raise
+
+        # Fall back to a single stream if any range was not honoured
+        if not ranged:
+            os.remove(file_path)
+        return ranged
+
+    def _download_range(self, url, file_path, byte_range, progress):
+        """Downloads a single byte range of a file in place."""
+        start, end = byte_range
+        res = self.session.get(url, stream=True, headers={
+            'Range': f'bytes={start}-{end}'
+        })
+        res.raise_for_status()
+
+        # Make sure the server returned only the requested range
+        if res.status_code != 206:
+            res.close()
+            return False
+
+        # Write the range at its offset in the file
+        with open(file_path, 'r+b') as f:
+            f.seek(start)
+            for chunk in res.iter_content(chunk_size=self.chunk_size):
+                f.write(chunk)
+                progress.update(len(chunk))
+        return True
+
     def _create_video_feed(self, file_dir, print_=False, limit=25):
         """Create a RSS feed from stored video data."""
         file_path = os.path.join(file_dir, f'{self.model_name}.xml')
@@ -169,26 +302,30 @@ class VideoContent(FanCultContent):
         fg = self._get_rss_feed_generator()
         fg.load_extension('media')
 
-        # Get all videos
-        videos = self.db.query(self.model) \
+        # Get the latest video rows without loading full model objects
+        columns = [
+            self.model.video_id, self.model.title, self.model.type,
+            self.model.date, self.model.url, self.model.image,
+            self.model.video, self.model.video_image
+        ]
+        videos = self.db.query(*columns) \
             .order_by(self.model.date.desc()) \
-            .limit(limit)\
-            .all()
+            .limit(limit) \
+            .yield_per(100)
 
         # Create entries for videos
         for video in videos:
             # Set up content
-            content = f'<p>{video.type}</p>' \
-                      f'<p><a href="{video.url}">' \
-                      f'<img src="{video.video_image}"/>' \
-                      f'</a></p>'
+            content = self.feed_content % (
+                video.type, video.url, video.video_image
+            )
             # Set RSS entry details
             fe = fg.add_entry()
             fe.id(str(video.video_id))
             fe.title(video.title)
             fe.content(content, type='CDATA')
             fe.description(video.type)
-            fe.published(pytz.utc.localize(video.date))
+            fe.published(video.date.replace(tzinfo=timezone.utc))
             fe.link(href=video.url)
             fe.author(self.copyright)
             fe.media.thumbnail({'url': video.image})
@@ -219,6 +356,8 @@ class VideoContent(FanCultContent):
             Column('video_image', URLType, nullable=False),
             Column('last_updated', DateTime, server_default=func.now(),
                    onupdate=func.now(), nullable=False),
+            Index('ix_videos_title_url', 'title', 'url'),
+            Index('ix_videos_date', 'date'),
         )
 
     @staticmethod
@@ -228,15 +367,15 @@ class VideoContent(FanCultContent):
         table_data = [[
             video.video_id,
             video.date.strftime('%d %B %Y'),
-            shorten(video.title, width=50),
+            _shorten(video.title),
             video.type,
-            shorten(video.url, width=50)
+            _shorten(video.url)
         ] for video in videos]
         return tabulate(table_data, fields, tablefmt=fmt)
 
     def get_video(self, video_id):
         """Get video in database by ID."""
-        video = self.db.query(self.model).get(video_id)
+        video = self.db.get(self.model, video_id)
         if not video:
             self.manager.error(f'No video found for ID: {video_id}')
             return None
@@ -272,14 +411,17 @@ class VideoContent(FanCultContent):
                       help='Download without confirmation.')
         @click.option('-d', '--dest', type=click.Path(exists=True),
                       help='Folder to download file to.')
+        @click.option('-p', '--parallel', default=1, show_default=True,
+                      type=click.IntRange(1, 16),
+                      help='Number of connections to download with.')
         @click.argument('video_id')
         @self.auto_login_user(with_account=True)
-        def fn(video_id, yes, dest, account):
+        def fn(video_id, yes, dest, parallel, account):
             """Download a video by ID."""
             video_path = self._get_download_dir(dest, account)
             video = self.get_video(video_id)
             if video:
-                self._download_video(video, video_path, yes)
+                self._download_video(video, video_path, yes, parallel)
         return fn
 
     @property
@@ -339,15 +481,25 @@ class VideoContent(FanCultContent):
             """Show all available videos."""
             if refresh:
                 self._update_videos()
-            # Set up query
-            query = self.db.query(self.model) \
+            # Set up query for only the listed columns
+            columns = [
+                self.model.video_id, self.model.date, self.model.title,
+                self.model.type, self.model.url
+            ]
+            query = self.db.query(*columns) \
                 .order_by(self.model.date.desc())
             # Handle type filtering
             if type_:
-                query = query.filter(self.model.type.like(f'%{type_}%'))
+                pattern = self._get_search_pattern(type_)
+                query = query.filter(
+                    self.model.type.like(pattern, escape='\\')
+                )
             # Handle search query
             if search:
-                query = query.filter(self.model.title.like(f'%{search}%'))
+                pattern = self._get_search_pattern(search)
+                query = query.filter(
+                    self.model.title.like(pattern, escape='\\')
+                )
             # Handle limit
             if number > 0:
                 query = query.limit(number)
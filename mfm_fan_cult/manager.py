@@ -22,7 +22,7 @@ import click
 from cryptography.fernet import Fernet
 
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import MetaData, create_engine
+from sqlalchemy import MetaData, create_engine, event
 from sqlalchemy.exc import InvalidRequestError
 from sqlalchemy.ext.automap import automap_base
 
@@ -54,6 +54,7 @@ class FanCultManager:
         self._types = get_content_types()
         # Setup the engine for the sqlite database
         self._engine = create_engine(self.db_uri)
+        event.listen(self._engine, 'connect', self._set_sqlite_pragmas)
         # Configure the SQLAlchemy metadata
         self._metadata = MetaData()
         self._metadata.bind = self._engine
@@ -87,6 +88,14 @@ class FanCultManager:
         """Decode data with the cipher manager."""
         return self.__cipher.decrypt(data)
 
+    @staticmethod
+    def _set_sqlite_pragmas(dbapi_connection, _):
+        """Use write-ahead logging to reduce sqlite commit costs."""
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
     def _load_db(self):
         """Dynamically loads database table schemas."""
         for type_ in self._types:
@@ -98,6 +107,10 @@ class FanCultManager:
         self._metadata.reflect(self._engine)
         # Make sure the tables exist
         self._metadata.create_all()
+        # Add any indexes missing from previously created tables
+        for table in self._metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(self._engine, checkfirst=True)
 
     def get_session(self):
         """Create a new database session using the session maker."""
@@ -34,17 +34,16 @@ setup(
         ]
     },
     install_requires=[
-        'beautifulsoup4',
-        'bs4',
         'click',
         'cryptography',
         'feedgen',
+        'lxml',
         'mutagen',
+        'orjson',
         'passlib',
         'python-dateutil',
-        'pytz',
         'requests',
-        'SQLAlchemy',
+        'SQLAlchemy>=1.4',
         'SQLAlchemy-Utils',
         'tabulate',
         'tqdm',